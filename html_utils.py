@@ -0,0 +1,121 @@
+from typing import List, NamedTuple, Optional
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import lxml.html
+    HTML_PARSER = 'lxml'
+except ImportError:
+    lxml = None
+    HTML_PARSER = 'html.parser'
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+# Only the scans table is needed from the listing page
+_TABLE_ONLY = SoupStrainer('table')
+_PRIVATE_IMG = {'alt': 'Private'}
+
+
+class TableRow(NamedTuple):
+    cells: List[str]
+    href: Optional[str]
+    is_private: bool
+
+
+class VerdictPage(NamedTuple):
+    has_warning: bool
+    panel_text: Optional[str]
+    red_text: Optional[str]
+
+
+def make_soup(html_content: str, parse_only: Optional[SoupStrainer] = None) -> BeautifulSoup:
+    """Parse HTML with the fastest available BeautifulSoup backend"""
+    return BeautifulSoup(html_content, HTML_PARSER, parse_only=parse_only)
+
+
+def parse_scan_table(html_content: str) -> List[TableRow]:
+    """Extract the data rows of the first table on the page"""
+    if LexborHTMLParser is not None:
+        return _parse_scan_table_lexbor(html_content)
+    if lxml is not None:
+        return _parse_scan_table_lxml(html_content)
+    return _parse_scan_table_soup(html_content)
+
+
+def _parse_scan_table_lexbor(html_content: str) -> List[TableRow]:
+    """Extract table rows using selectolax's Lexbor backend"""
+    table = LexborHTMLParser(html_content).css_first('table')
+    if table is None:
+        return []
+
+    rows = []
+    for row in table.css('tr')[1:]:
+        cells = row.css('td')
+        link = cells[1].css_first('a') if len(cells) > 1 else None
+        rows.append(TableRow(
+            cells=[cell.text().strip() for cell in cells],
+            href=link.attributes.get('href') if link else None,
+            is_private=row.css_first('img[alt="Private"]') is not None
+        ))
+    return rows
+
+
+def _parse_scan_table_lxml(html_content: str) -> List[TableRow]:
+    """Extract table rows with lxml XPath queries"""
+    if not html_content.strip():
+        return []
+
+    tables = lxml.html.fromstring(html_content).xpath('(//table)[1]')
+    if not tables:
+        return []
+
+    rows = []
+    for row in tables[0].xpath('.//tr')[1:]:
+        cells = row.xpath('.//td')
+        hrefs = cells[1].xpath('.//a/@href') if len(cells) > 1 else []
+        rows.append(TableRow(
+            cells=[cell.text_content().strip() for cell in cells],
+            href=hrefs[0] if hrefs else None,
+            is_private=bool(row.xpath('.//img[@alt="Private"]'))
+        ))
+    return rows
+
+
+def _parse_scan_table_soup(html_content: str) -> List[TableRow]:
+    """Extract table rows using BeautifulSoup"""
+    table = make_soup(html_content, parse_only=_TABLE_ONLY).find('table')
+    if not table:
+        return []
+
+    rows = []
+    for row in table.find_all('tr')[1:]:
+        cells = row.find_all('td')
+        link = cells[1].find('a') if len(cells) > 1 else None
+        rows.append(TableRow(
+            cells=[cell.text.strip() for cell in cells],
+            href=link.get('href') if link else None,
+            is_private=row.find('img', _PRIVATE_IMG) is not None
+        ))
+    return rows
+
+
+def parse_verdict_page(html_content: str, warning: str) -> Optional[VerdictPage]:
+    """Pull the verdict text out of a rendered scan page with Lexbor, if available"""
+    if LexborHTMLParser is None:
+        return None
+
+    tree = LexborHTMLParser(html_content)
+    summary = tree.css_first('#summary')
+    if summary is None:
+        return None
+
+    panel = tree.css_first('div.panel-body')
+    red = tree.css_first('span.red')
+    return VerdictPage(
+        # Only collect the summary text when the raw HTML mentions the warning at all
+        has_warning=warning in html_content and warning in summary.text(),
+        panel_text=panel.text() if panel else None,
+        red_text=red.text() if red else None
+    )
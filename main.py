@@ -1,12 +1,18 @@
 import time
+import random
 import logging
-from multiprocessing import Process, Queue, Value, Lock
+from multiprocessing import Process, Value
 import threading
+import webdriver_utils
+from proxy_handler import ProxyHandler
+from storage_utils import migrate_json_array
 from urlscan_scraper import (
     setup_logging,
     url_producer,
     verdict_consumer,
-    progress_monitor
+    result_writer,
+    progress_monitor,
+    make_queue
 )
 
 
@@ -14,34 +20,62 @@ def main():
     setup_logging()
 
     # Shared resources
-    url_queue = Queue()
+    url_queue = make_queue()
+    result_queue = make_queue()
     backlog_count = Value('i', 0)
-    backlog_lock = Lock()
     stop_flag = Value('i', 0)
 
-    # File paths
-    output_file = "urlscan_results.json"
-    verdicts_file = "urlscan_verdicts.json"
+    # File paths; results and verdicts are JSON Lines (name them .jsonl.gz to compress)
+    output_file = "urlscan_results.jsonl"
+    verdicts_file = "urlscan_verdicts.jsonl"
+    seen_file = "urlscan_seen.txt"
+    stats_file = "urlscan_statistics.txt"
+
+    # Carry the data from the old .json array files over on the first run with JSON Lines
+    for legacy_file, jsonl_file in (("urlscan_results.json", output_file),
+                                    ("urlscan_verdicts.json", verdicts_file)):
+        migrated = migrate_json_array(legacy_file, jsonl_file)
+        if migrated:
+            logging.info(f"Converted {migrated} records from {legacy_file} to {jsonl_file}")
+
+    # Resolve ChromeDriver once up front; forked producer and consumers inherit the cached path
+    webdriver_utils.get_driver_path()
+
+    # Validate proxies once and hand the pool to every consumer instead of probing per driver
+    proxies = ProxyHandler(max_proxies=10).get_working_proxies()
+
+    # Attach every consumer to one shared Chrome, a tab per driver, instead of a browser each
+    use_shared_browser = False  # Adjust based on your needs
+    shared_browser = None
+    debugger_address = None
+    if use_shared_browser:
+        shared_browser = webdriver_utils.launch_shared_browser(proxy=random.choice(proxies) if proxies else None)
+        debugger_address = webdriver_utils.SHARED_BROWSER_ADDRESS
 
     try:
+        # Start the writer first; it owns the output files and outlives the consumers
+        writer = Process(target=result_writer,
+                         args=(result_queue, output_file, verdicts_file, stats_file))
+        writer.start()
+
         # Start producer process
         producer = Process(target=url_producer,
-                           args=(url_queue, backlog_count, backlog_lock, stop_flag))
+                           args=(url_queue, backlog_count, stop_flag, seen_file))
         producer.start()
 
         # Start consumer processes
         consumers = []
-        num_consumers = 3  # Adjust based on your needs
+        num_consumers = 3  # Adjust based on your needs; tabs are cheap enough to raise this when shared
         for _ in range(num_consumers):
             consumer = Process(target=verdict_consumer,
-                               args=(url_queue, backlog_count, backlog_lock, stop_flag,
-                                     output_file, verdicts_file))
+                               args=(url_queue, result_queue, backlog_count, stop_flag),
+                               kwargs={'debugger_address': debugger_address, 'proxies': proxies})
             consumer.start()
             consumers.append(consumer)
 
         # Start progress monitor in a separate thread
         progress_thread = threading.Thread(target=progress_monitor,
-                                           args=(backlog_count, backlog_lock, stop_flag))
+                                           args=(backlog_count, stop_flag))
         progress_thread.daemon = True
         progress_thread.start()
 
@@ -61,6 +95,13 @@ def main():
         for consumer in consumers:
             consumer.join()
 
+        # Let the writer flush what the consumers handed it, then stop
+        result_queue.put(None)
+        writer.join()
+
+        if shared_browser:
+            shared_browser.terminate()
+
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
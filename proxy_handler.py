@@ -1,20 +1,69 @@
 import requests
-from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from html_utils import parse_scan_table
+from storage_utils import loads
 import logging
-from threading import Thread
-import queue
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+from threading import local, Lock as ThreadLock, Thread
 import random
+import time
 from typing import List, Dict, Optional
 from multiprocessing import Lock
 
+# Proxy probes in flight at once; each one mostly waits on its socket
+VALIDATION_WORKERS = 50
+
+# Empty-bodied endpoints; HTTPS so a probe also proves the proxy tunnels CONNECT like Chrome needs
+VALIDATION_URLS = ['https://www.gstatic.com/generate_204', 'https://connectivitycheck.gstatic.com/generate_204']
+
+PROXY_SOURCES = [
+    'https://free-proxy-list.net/',
+    'https://api.proxyscrape.com/v2/?request=displayproxies&protocol=http&timeout=5000&country=all&ssl=yes&anonymity=all',
+    'https://proxylist.geonode.com/api/proxy-list?limit=100&page=1&sort_by=lastChecked&sort_type=desc&protocols=http%2Chttps'
+]
+
+# Candidates validated per wanted proxy; a shuffled oversample finds enough without probing every one
+OVERSAMPLE_FACTOR = 5
+
+# Give up on the remaining candidates after this many seconds if enough weren't found
+VALIDATION_DEADLINE = 30
+
+# Validated proxies are trusted this long before the pool is refetched
+PROXY_POOL_TTL = 120
+
+# A depleted pool is refilled at most this often, so a failed refresh isn't retried on every call
+LOW_POOL_RETRY_INTERVAL = 60
+
+# Share of max_proxies below which evictions trigger a background refill
+PROXY_REFILL_FRACTION = 0.5
+
+# Consecutive failures after which a proxy is dropped from the pool
+PROXY_MAX_FAILURES = 3
+
 
 class ProxyHandler:
-    def __init__(self, max_proxies: int = 10):
+    def __init__(self, max_proxies: int = 10, pool_ttl: Optional[float] = PROXY_POOL_TTL,
+                 proxies: Optional[List[Dict]] = None):
+        # proxies seeds the pool with ones validated elsewhere; a pool_ttl of None never expires,
+        # so such a pool is refilled only once failures have evicted enough of it
         self.max_proxies = max_proxies
-        self.working_proxies: List[Dict] = []
+        self.pool_ttl = pool_ttl
+        self.refill_below = max(1, int(max_proxies * PROXY_REFILL_FRACTION))
+        self.working_proxies: List[Dict] = list(proxies or [])
+        self.refreshed_at = time.time() if proxies else 0.0
+        self.failure_counts: Dict[str, int] = {}
         self.proxy_lock = Lock()
+        # Held for the duration of a refetch, so only one runs at a time
+        self.refresh_lock = ThreadLock()
         self.setup_logging()
 
+        # Keep-alive session for the proxy list sources; validators get one per thread
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=32, pool_maxsize=32, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.thread_sessions = local()
+
     def setup_logging(self):
         """Configure logging settings"""
         logging.basicConfig(
@@ -23,40 +72,36 @@ class ProxyHandler:
         )
 
     def fetch_free_proxies(self) -> List[Dict]:
-        """Fetch free proxies from multiple sources"""
+        """Fetch free proxies from all sources concurrently"""
+        with ThreadPoolExecutor(max_workers=len(PROXY_SOURCES)) as executor:
+            results = executor.map(self.fetch_proxy_source, PROXY_SOURCES)
+            return [proxy for source_proxies in results for proxy in source_proxies]
+
+    def fetch_proxy_source(self, source: str) -> List[Dict]:
+        """Fetch proxies from a single source"""
         proxies = []
-        sources = [
-            'https://free-proxy-list.net/',
-            'https://api.proxyscrape.com/v2/?request=displayproxies&protocol=http&timeout=5000&country=all&ssl=yes&anonymity=all',
-            'https://proxylist.geonode.com/api/proxy-list?limit=100&page=1&sort_by=lastChecked&sort_type=desc&protocols=http%2Chttps'
-        ]
-
-        for source in sources:
-            try:
-                response = requests.get(source, timeout=10)
+        try:
+            # Streamed so the plain-text list is parsed off the socket instead of buffered whole
+            with self.session.get(source, timeout=10, stream=True) as response:
                 if 'free-proxy-list.net' in source:
-                    soup = BeautifulSoup(response.text, 'html.parser')
-                    proxy_table = soup.find('table')
-                    if proxy_table:
-                        rows = proxy_table.find_all('tr')[1:]
-                        for row in rows:
-                            cols = row.find_all('td')
-                            if len(cols) >= 7 and cols[6].text.strip() == 'yes':
-                                ip, port = cols[0].text.strip(), cols[1].text.strip()
-                                proxies.append({
-                                    'http': f'http://{ip}:{port}',
-                                    'https': f'http://{ip}:{port}'
-                                })
+                    for row in parse_scan_table(response.text):
+                        cols = row.cells
+                        if len(cols) >= 7 and cols[6] == 'yes':
+                            ip, port = cols[0], cols[1]
+                            proxies.append({
+                                'http': f'http://{ip}:{port}',
+                                'https': f'http://{ip}:{port}'
+                            })
                 elif 'proxyscrape.com' in source:
-                    for line in response.text.split('\n'):
-                        if ':' in line:
-                            ip, port = line.strip().split(':')
+                    for line in response.iter_lines(decode_unicode=True):
+                        if line and ':' in line:
+                            ip, _, port = line.strip().partition(':')
                             proxies.append({
                                 'http': f'http://{ip}:{port}',
                                 'https': f'http://{ip}:{port}'
                             })
                 elif 'geonode.com' in source:
-                    data = response.json()
+                    data = loads(response.content)
                     for proxy in data.get('data', []):
                         ip, port = proxy.get('ip'), proxy.get('port')
                         if ip and port:
@@ -64,72 +109,124 @@ class ProxyHandler:
                                 'http': f'http://{ip}:{port}',
                                 'https': f'https://{ip}:{port}'
                             })
-            except Exception as e:
-                logging.error(f"Error fetching from {source}: {e}")
+        except Exception as e:
+            logging.error(f"Error fetching from {source}: {e}")
 
         return proxies
 
     def validate_proxy(self, proxy: Dict) -> bool:
         """Validate a single proxy"""
-        test_urls = ['https://www.google.com', 'https://www.cloudflare.com', 'https://www.amazon.com']
         try:
-            response = requests.get(
-                random.choice(test_urls),
+            response = self.get_thread_session().head(
+                random.choice(VALIDATION_URLS),
                 proxies=proxy,
-                timeout=5,
-                headers={'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0.0.0 Safari/537.36'}
+                timeout=3,
+                allow_redirects=False
             )
-            return response.status_code == 200
+            return response.status_code in (200, 204)
         except Exception:
             return False
 
+    def get_thread_session(self) -> requests.Session:
+        """Return the calling validator thread's own session"""
+        session = getattr(self.thread_sessions, 'session', None)
+        if session is None:
+            session = requests.Session()
+            self.thread_sessions.session = session
+        return session
+
     def validate_proxies(self, proxies: List[Dict]) -> List[Dict]:
-        """Validate multiple proxies using threading"""
-        proxy_queue = queue.Queue()
+        """Validate multiple proxies concurrently, stopping once enough are found"""
         valid_proxies = []
+        if not proxies:
+            return valid_proxies
 
-        for proxy in proxies:
-            proxy_queue.put(proxy)
-
-        def worker():
-            while True:
-                try:
-                    proxy = proxy_queue.get_nowait()
-                except queue.Empty:
-                    break
-
-                if self.validate_proxy(proxy):
-                    with self.proxy_lock:
-                        if len(valid_proxies) < self.max_proxies:
-                            valid_proxies.append(proxy)
-                            logging.info(f"Found working proxy: {proxy}")
-                proxy_queue.task_done()
-
-        threads = []
-        num_threads = min(20, len(proxies))
-        for _ in range(num_threads):
-            t = Thread(target=worker)
-            t.daemon = True
-            t.start()
-            threads.append(t)
-
-        proxy_queue.join()
-        for t in threads:
-            t.join()
-
-        return valid_proxies[:self.max_proxies]
+        proxies = random.sample(proxies, min(len(proxies), self.max_proxies * OVERSAMPLE_FACTOR))
+
+        executor = ThreadPoolExecutor(max_workers=min(VALIDATION_WORKERS, len(proxies)))
+        futures = {executor.submit(self.validate_proxy, proxy): proxy for proxy in proxies}
+        try:
+            for future in as_completed(futures, timeout=VALIDATION_DEADLINE):
+                if future.result():
+                    proxy = futures[future]
+                    valid_proxies.append(proxy)
+                    logging.info(f"Found working proxy: {proxy}")
+                    if len(valid_proxies) >= self.max_proxies:
+                        break
+        except TimeoutError:
+            logging.info(f"Proxy validation deadline hit with {len(valid_proxies)} working proxies")
+        finally:
+            # Drop probes that haven't started; running ones end within their own timeout
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        return valid_proxies
+
+    def get_working_proxies(self) -> List[Dict]:
+        """Get the validated proxy pool, refilling it in the background once low or older than the TTL"""
+        if not self.refreshed_at:
+            # Nothing to serve yet, so the very first fetch is waited for
+            with self.refresh_lock:
+                if not self.refreshed_at:
+                    self.refresh_proxies()
+        elif self.needs_refill():
+            self.start_refill()
+
+        return self.working_proxies
+
+    def needs_refill(self) -> bool:
+        """Check whether the pool is running low or older than its TTL"""
+        age = time.time() - self.refreshed_at
+        if len(self.working_proxies) < self.refill_below:
+            return age > LOW_POOL_RETRY_INTERVAL
+        return self.pool_ttl is not None and age > self.pool_ttl
+
+    def start_refill(self):
+        """Refetch the pool on a daemon thread unless one is already running"""
+        if not self.refresh_lock.acquire(blocking=False):
+            return
+        if not self.needs_refill():
+            self.refresh_lock.release()
+            return
+
+        Thread(target=self.refill, daemon=True).start()
+
+    def refill(self):
+        """Background refetch; callers keep using the current pool until it is swapped in"""
+        try:
+            self.refresh_proxies()
+        except Exception as e:
+            logging.error(f"Error refreshing proxy pool: {e}")
+        finally:
+            self.refresh_lock.release()
 
     def get_working_proxy(self) -> Optional[Dict]:
         """Get a random working proxy"""
-        if not self.working_proxies:
-            logging.info("Fetching and validating new proxies...")
-            proxies = self.fetch_free_proxies()
-            self.working_proxies = self.validate_proxies(proxies)
-
-        return random.choice(self.working_proxies) if self.working_proxies else None
+        working_proxies = self.get_working_proxies()
+        return random.choice(working_proxies) if working_proxies else None
 
     def refresh_proxies(self):
         """Refresh the proxy pool"""
         logging.info("Refreshing proxy pool...")
         proxies = self.fetch_free_proxies()
-        self.working_proxies = self.validate_proxies(proxies)
\ No newline at end of file
+        working_proxies = self.validate_proxies(proxies)
+        with self.proxy_lock:
+            # A refetch that found nothing keeps whatever is left of the current pool
+            if working_proxies:
+                self.working_proxies = working_proxies
+                self.failure_counts.clear()
+            self.refreshed_at = time.time()
+
+    def report_failure(self, proxy: Dict):
+        """Count a failed request through a proxy, evicting it after repeated failures"""
+        key = proxy['https']
+        with self.proxy_lock:
+            self.failure_counts[key] = self.failure_counts.get(key, 0) + 1
+            if self.failure_counts[key] >= PROXY_MAX_FAILURES:
+                self.working_proxies = [p for p in self.working_proxies if p['https'] != key]
+                del self.failure_counts[key]
+                logging.info(f"Evicted failing proxy: {proxy}")
+
+    def report_success(self, proxy: Dict):
+        """Reset a proxy's consecutive failure count"""
+        with self.proxy_lock:
+            self.failure_counts.pop(proxy['https'], None)
\ No newline at end of file
@@ -1,61 +1,88 @@
 from collections import Counter
-from typing import List, Dict, Any
-import json
+from itertools import islice
+from typing import List, Dict, Any, Iterable, Iterator
 import logging
 from datetime import datetime
+from storage_utils import count_records, iter_records
 
+# Verdicts counted per batch while rehydrating from disk
+LOAD_CHUNK_SIZE = 10000
 
-def generate_statistics(verdicts: List[Dict[str, Any]], all_results: List[Dict[str, Any]]) -> Dict[str, Any]:
-    """Generate statistics from verdict and results data"""
-    # Initialize counters
-    targeted_companies = Counter()
-    hosting_providers = Counter()
-    unknown_targets = 0
 
-    # Process each verdict
-    for verdict in verdicts:
+def chunked(records: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    """Split an iterable of records into lists of at most size records"""
+    records = iter(records)
+    return iter(lambda: list(islice(records, size)), [])
+
+
+class StatsAccumulator:
+    """Running statistics, updated per saved record instead of recomputed from the files"""
+
+    def __init__(self):
+        self.targeted_companies = Counter()
+        self.hosting_providers = Counter()
+        self.total_analyzed = 0
+        self.total_malicious = 0
+        self.unknown_targets = 0
+
+    def load(self, verdicts_file: str, results_file: str):
+        """Rehydrate from the existing output files with one streaming pass"""
+        for chunk in chunked(iter_records(verdicts_file), LOAD_CHUNK_SIZE):
+            self.add_verdicts(chunk)
+        self.total_analyzed = count_records(results_file)
+
+    def add_result(self, result: Dict[str, Any]):
+        """Count an analyzed result"""
+        self.total_analyzed += 1
+
+    def add_verdicts(self, verdicts: List[Dict[str, Any]]):
+        """Count a batch of malicious verdicts with one Counter update per field"""
+        self.total_malicious += len(verdicts)
         try:
-            metadata = verdict.get('metadata', {})
+            # Malformed entries are filtered out once up front instead of guarded one by one
+            metadatas = [verdict.get('metadata') or {} for verdict in verdicts if isinstance(verdict, dict)]
+            metadatas = [metadata for metadata in metadatas if isinstance(metadata, dict)]
 
             # Count hosting providers (ASN organizations)
-            asn_org = metadata.get('asn_org')
-            if asn_org:
-                hosting_providers[asn_org] += 1
+            self.hosting_providers.update(
+                metadata['asn_org'] for metadata in metadatas if metadata.get('asn_org')
+            )
 
             # Count targeted brands/companies
-            brands = metadata.get('targeted_brands', [])
-            if not brands:
-                unknown_targets += 1
-                targeted_companies['Unknown'] += 1
-            else:
-                for brand in brands:
-                    brand_name = brand.get('name')
-                    if brand_name:
-                        targeted_companies[brand_name] += 1
+            unknown = sum(1 for metadata in metadatas if not metadata.get('targeted_brands'))
+            if unknown:
+                self.unknown_targets += unknown
+                self.targeted_companies['Unknown'] += unknown
+            self.targeted_companies.update(
+                brand['name']
+                for metadata in metadatas
+                for brand in metadata.get('targeted_brands') or []
+                if isinstance(brand, dict) and brand.get('name')
+            )
 
         except Exception as e:
-            logging.error(f"Error processing verdict for statistics: {str(e)}")
-            continue
-
-    # Prepare statistics
-    stats = {
-        'timestamp': datetime.now().isoformat(),
-        'total_analyzed': len(all_results),
-        'total_malicious': len(verdicts),
-        'malicious_percentage': round((len(verdicts) / len(all_results) * 100), 2) if all_results else 0,
-        'unknown_target_count': unknown_targets,
-        'unknown_target_percentage': round((unknown_targets / len(verdicts) * 100), 2) if verdicts else 0,
-        'top_targeted_companies': [
-            {'name': name, 'count': count}
-            for name, count in targeted_companies.most_common(10)
-        ],
-        'top_hosting_providers': [
-            {'name': name, 'count': count}
-            for name, count in hosting_providers.most_common(10)
-        ]
-    }
-
-    return stats
+            logging.error(f"Error processing verdicts for statistics: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Build the statistics report from the running counters"""
+        total_analyzed = self.total_analyzed
+        total_malicious = self.total_malicious
+        return {
+            'timestamp': datetime.now().isoformat(),
+            'total_analyzed': total_analyzed,
+            'total_malicious': total_malicious,
+            'malicious_percentage': round((total_malicious / total_analyzed * 100), 2) if total_analyzed else 0,
+            'unknown_target_count': self.unknown_targets,
+            'unknown_target_percentage': round((self.unknown_targets / total_malicious * 100), 2) if total_malicious else 0,
+            'top_targeted_companies': [
+                {'name': name, 'count': count}
+                for name, count in self.targeted_companies.most_common(10)
+            ],
+            'top_hosting_providers': [
+                {'name': name, 'count': count}
+                for name, count in self.hosting_providers.most_common(10)
+            ]
+        }
 
 
 def save_statistics(stats: Dict[str, Any], stats_file: str):
@@ -92,22 +119,3 @@ def save_statistics(stats: Dict[str, Any], stats_file: str):
 
     except Exception as e:
         logging.error(f"Error saving statistics: {str(e)}")
-
-
-def update_statistics(verdicts_file: str, results_file: str, stats_file: str):
-    """Update statistics when new verdicts are added"""
-    try:
-        # Load verdicts
-        with open(verdicts_file, 'r', encoding='utf-8') as f:
-            verdicts = json.load(f)
-
-        # Load all results
-        with open(results_file, 'r', encoding='utf-8') as f:
-            all_results = json.load(f)
-
-        # Generate and save statistics
-        stats = generate_statistics(verdicts, all_results)
-        save_statistics(stats, stats_file)
-
-    except Exception as e:
-        logging.error(f"Error updating statistics: {str(e)}")
\ No newline at end of file
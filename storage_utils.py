@@ -0,0 +1,217 @@
+import gzip
+import json
+import os
+from contextlib import contextmanager
+from typing import List, Dict, Any, Iterable, Iterator, Set
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Fast compression keeps .gz appends cheap; gzip members simply concatenate
+GZIP_COMPRESSLEVEL = 3
+
+# Seen URLs kept per generation; two generations are held, so at most twice this many are remembered
+SEEN_GENERATION_SIZE = 50000
+
+
+def dumps(record: Any, indent: bool = False) -> bytes:
+    """Encode a record to UTF-8 JSON, using orjson when it is installed"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if indent else 0)
+        return orjson.dumps(record, option=option)
+    return json.dumps(record, indent=2 if indent else None, ensure_ascii=False).encode('utf-8')
+
+
+def loads(data: bytes) -> Any:
+    """Decode UTF-8 JSON, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def open_binary(path: str, mode: str):
+    """Open a file in binary mode, gzip-compressed when the path ends in .gz"""
+    if path.endswith('.gz'):
+        return gzip.open(path, mode, compresslevel=GZIP_COMPRESSLEVEL)
+    return open(path, mode)
+
+
+@contextmanager
+def locked(f):
+    """Hold an exclusive lock on an open file or raw fd so appends from other processes can't interleave"""
+    if fcntl is None:
+        yield f
+        return
+
+    fd = f if isinstance(f, int) else f.fileno()
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    try:
+        yield f
+    finally:
+        if not isinstance(f, int):
+            f.flush()
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+def write_all(fd: int, data: bytes):
+    """Write bytes to a raw fd, retrying on short writes"""
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+
+def append_jsonl(path: str, records: Iterable[Dict[str, Any]]):
+    """Append records to a (optionally gzipped) JSON Lines file, one object per line"""
+    lines = b''.join(dumps(record) + b'\n' for record in records)
+    if not lines:
+        return
+    if path.endswith('.gz'):
+        # Compress up front so the locked write is one complete gzip member
+        lines = gzip.compress(lines, compresslevel=GZIP_COMPRESSLEVEL)
+
+    # A raw O_APPEND fd skips the buffered writer; the batch goes out in one write call
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        with locked(fd):
+            write_all(fd, lines)
+    finally:
+        os.close(fd)
+
+
+def iter_jsonl(path: str) -> Iterator[Dict[str, Any]]:
+    """Stream records from a (optionally gzipped) JSON Lines file"""
+    if not os.path.exists(path):
+        return
+
+    with open_binary(path, 'rb') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield loads(line)
+
+
+def append_records(path: str, records: Iterable[Dict[str, Any]]):
+    """Append records to a JSON Lines file, gzip-compressed when the path ends in .gz
+
+    Legacy .json arrays are only read; convert them with migrate_json_array first.
+    """
+    if path.endswith('.json'):
+        raise ValueError(f"{path} is a JSON array; results are written as JSON Lines")
+    append_jsonl(path, records)
+
+
+def iter_records(path: str) -> Iterator[Dict[str, Any]]:
+    """Stream records from a .json array or a JSON Lines file"""
+    if not path.endswith('.json'):
+        yield from iter_jsonl(path)
+        return
+
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        with open(path, 'rb') as f:
+            if ijson is not None:
+                # Stream the array items instead of materialising the whole document
+                yield from ijson.items(f, 'item', use_float=True)
+            else:
+                yield from loads(f.read())
+
+
+def migrate_json_array(json_path: str, jsonl_path: str) -> int:
+    """Convert a legacy .json array into a new JSON Lines file once, leaving the array untouched
+
+    Nothing happens when the JSON Lines file already exists or there is no array to convert.
+    Returns the number of records converted.
+    """
+    if os.path.exists(jsonl_path) or not os.path.exists(json_path):
+        return 0
+
+    # Write next to the target and rename, so an interrupted run converts again from scratch
+    partial_path = jsonl_path + '.partial'
+    count = 0
+    opener = gzip.open if jsonl_path.endswith('.gz') else open
+    with opener(partial_path, 'wb') as f:
+        for record in iter_records(json_path):
+            f.write(dumps(record) + b'\n')
+            count += 1
+    os.replace(partial_path, jsonl_path)
+    return count
+
+
+def count_records(path: str) -> int:
+    """Count records; JSON Lines files are counted by line without decoding them"""
+    if path.endswith('.json'):
+        return sum(1 for _ in iter_records(path))
+    if not os.path.exists(path):
+        return 0
+
+    with open_binary(path, 'rb') as f:
+        return sum(1 for line in f if line.strip())
+
+
+class SeenUrls:
+    """Exact set of recently queued URLs persisted to a one-URL-per-line side file
+
+    URLs are kept in two generations of up to SEEN_GENERATION_SIZE each. When the newer one
+    fills, the older is forgotten and the side file is rewritten with what is left, so memory,
+    the file and the startup read all stay bounded. The listing and search API only return
+    recent scans, so a URL old enough to have been forgotten doesn't come back.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.previous: Set[str] = set()
+        self.current: Set[str] = set()
+        self.pending: List[str] = []
+        self.rotated = False
+
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    url = line.rstrip('\n')
+                    if url:
+                        self._remember(url)
+
+    def __contains__(self, url: str) -> bool:
+        return url in self.current or url in self.previous
+
+    def __len__(self) -> int:
+        return len(self.current) + len(self.previous)
+
+    def add(self, url: str):
+        """Mark a URL as seen; it is written to disk on the next flush"""
+        if url not in self:
+            self._remember(url)
+            self.pending.append(url)
+
+    def flush(self):
+        """Write newly seen URLs to the side file, rewriting it after a rotation"""
+        if self.rotated:
+            # Older generation first, so a reload rotates at the same point
+            partial_path = self.path + '.partial'
+            with open(partial_path, 'w', encoding='utf-8') as f:
+                f.write(''.join(url + '\n' for url in self.previous))
+                f.write(''.join(url + '\n' for url in self.current))
+            os.replace(partial_path, self.path)
+            self.rotated = False
+        elif self.pending:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(''.join(url + '\n' for url in self.pending))
+        self.pending.clear()
+
+    def _remember(self, url: str):
+        self.current.add(url)
+        if len(self.current) >= SEEN_GENERATION_SIZE:
+            self.previous = self.current
+            self.current = set()
+            self.rotated = True
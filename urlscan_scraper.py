@@ -1,19 +1,40 @@
 import time
 import logging
-import json
-import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from typing import List, Dict, Any
-from bs4 import BeautifulSoup
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from multiprocessing import Queue, Value, Lock
+from functools import partial
+from typing import List, Dict, Any, Optional, Set
+from multiprocessing import Queue, Value
 from queue import Empty
 import tqdm
 import webdriver_utils
 import verdict_processor
-from stats_processor import update_statistics
+from proxy_handler import ProxyHandler
+from html_utils import TableRow, parse_scan_table
+from stats_processor import StatsAccumulator, save_statistics
+from storage_utils import SeenUrls, append_records, iter_records, loads
+
+try:
+    from faster_fifo import Queue as FastQueue
+    import faster_fifo_reduction  # noqa: F401  (lets the queues be pickled into spawned processes)
+except ImportError:
+    FastQueue = None
+
+# Scan pages fetched concurrently within each consumer process
+VERDICT_WORKERS = 2
+
+# Recent scans come from the search API; the rendered landing page is only a fallback
+SEARCH_API_URL = "https://urlscan.io/api/v1/search/"
+SEARCH_QUERY = "date:>now-1m"
+SEARCH_SIZE = 100
+
+# Shared-memory ring buffer size of each faster_fifo queue
+QUEUE_SIZE_BYTES = 16 * 1024 * 1024
+
+# Result writer batching, and how often it refreshes the statistics report
+WRITER_BATCH_SIZE = 64
+WRITER_FLUSH_TIMEOUT = 0.2
+STATS_INTERVAL = 30
 
 
 def setup_logging():
@@ -24,112 +45,187 @@ def setup_logging():
     )
 
 
-def save_results(results: List[Dict[str, Any]], output_file: str, is_verdict: bool = False):
-    """Save results to appropriate JSON file"""
+# URLs already written to each verdicts file, loaded once per process
+_seen_verdict_urls: Dict[str, Set[str]] = {}
+
+
+def save_results(results: List[Dict[str, Any]], output_file: str,
+                 is_verdict: bool = False) -> List[Dict[str, Any]]:
+    """Append results to the appropriate results file and return those written
+
+    Verdict results arrive pre-filtered to malicious and are deduped by URL.
+    """
     if not results:
-        return
+        return []
 
     try:
-        existing_data = []
-        if os.path.exists(output_file):
-            with open(output_file, 'r', encoding='utf-8') as f:
-                existing_data = json.load(f)
-
         if is_verdict:
-            # Only filter for malicious if this is the verdicts file
-            results = [r for r in results if r['verdict'].lower() == 'malicious']
-            if not results:
-                return
-
-            seen_urls = {item['url'] for item in existing_data}
-            results = [r for r in results if r['url'] not in seen_urls]
+            seen_urls = _seen_verdict_urls.get(output_file)
+            if seen_urls is None:
+                seen_urls = {item['url'] for item in iter_records(output_file)}
+                _seen_verdict_urls[output_file] = seen_urls
+            # Also drop repeats within the batch; seen_urls is only extended once the write succeeds
+            batch_urls = set()
+            unique_results = []
+            for result in results:
+                if result['url'] not in seen_urls and result['url'] not in batch_urls:
+                    batch_urls.add(result['url'])
+                    unique_results.append(result)
+            results = unique_results
 
             if not results:
-                return
+                return []
 
-        existing_data.extend(results)
+        append_records(output_file, results)
 
-        with open(output_file, 'w', encoding='utf-8') as f:
-            json.dump(existing_data, f, indent=2, ensure_ascii=False)
-
-        # Update statistics with correct file order
-        stats_file = "urlscan_statistics.txt"
-        verdicts_file = "urlscan_verdicts.json"  # This should be your verdicts file
-        results_file = "urlscan_results.json"    # This should be your results file
-        update_statistics(verdicts_file, results_file, stats_file)
+        if is_verdict:
+            seen_urls.update(batch_urls)
+        return results
 
     except Exception as e:
         logging.error(f"Error saving results: {str(e)}")
+        return []
 
-def process_table_row(row, base_url, seen_urls):
-    """Process a single table row and return scan data if valid"""
+def process_table_row(row: TableRow, base_url, seen_scan_urls, timestamp: str):
+    """Process a single table row and return scan data if valid and not seen before"""
     try:
-        cells = row.find_all('td')
+        cells = row.cells
         if len(cells) < 7:
             return None
 
-        url = cells[1].text.strip()
-        if not url or url == "Loading..." or url in seen_urls:
+        url, age, size, requests, ips, threats = cells[1:7]
+        if not url or url == "Loading...":
             return None
 
         # Get scan URL
-        link = cells[1].find('a')
         scan_url = None
-        if link and link.get('href'):
-            href = link.get('href')
+        if row.href:
+            href = row.href
             scan_url = f"{base_url}{href}" if href.startswith('/') else href
         else:
             scan_url = f"{base_url}/result/{url}"
 
-        if not scan_url:
+        # Dedupe on the scan itself: a rescan of a known URL is a new result
+        if not scan_url or scan_url in seen_scan_urls:
             return None
 
         return {
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': timestamp,
             'url': url,
             'scan_url': scan_url,
-            'age': cells[2].text.strip(),
-            'size': cells[3].text.strip(),
-            'requests': cells[4].text.strip(),
-            'ips': cells[5].text.strip(),
-            'threats': cells[6].text.strip(),
-            'status': 'locked' if row.find('img', {'alt': 'Private'}) else 'public'
+            'age': age,
+            'size': size,
+            'requests': requests,
+            'ips': ips,
+            'threats': threats,
+            'status': 'locked' if row.is_private else 'public'
         }
     except Exception as e:
         logging.error(f"Error processing row: {str(e)}")
         return None
 
 
-def url_producer(url_queue: Queue, backlog_count: Value, backlog_lock: Lock, stop_flag: Value):
+def process_search_result(result: Dict[str, Any], base_url, seen_scan_urls, timestamp: str):
+    """Map a search API result to the scan data a table row would produce"""
+    try:
+        task = result.get('task', {})
+        stats = result.get('stats', {})
+        url = task.get('url') or result.get('page', {}).get('url')
+        scan_id = result.get('_id')
+        if not url or not scan_id:
+            return None
+
+        scan_url = f"{base_url}/result/{scan_id}/"
+        if scan_url in seen_scan_urls:
+            return None
+
+        return {
+            'timestamp': timestamp,
+            'url': url,
+            'scan_url': scan_url,
+            'age': task.get('time'),
+            'size': stats.get('dataLength'),
+            'requests': stats.get('requests'),
+            'ips': stats.get('uniqIPs'),
+            'threats': None,
+            'status': 'public' if task.get('visibility', 'public') == 'public' else 'locked'
+        }
+    except Exception as e:
+        logging.error(f"Error processing search result: {str(e)}")
+        return None
+
+
+def fetch_recent_scans(base_url, seen_scan_urls, timestamp: str) -> Optional[List[Dict[str, Any]]]:
+    """Fetch new scans from the search API, or None if it can't be used right now"""
+    try:
+        response = verdict_processor.get_http_session().get(
+            SEARCH_API_URL,
+            params={'q': SEARCH_QUERY, 'size': SEARCH_SIZE},
+            headers=verdict_processor.get_api_headers(),
+            timeout=15
+        )
+        if response.status_code != 200:
+            logging.debug(f"Search API returned {response.status_code}")
+            return None
+        results = loads(response.content).get('results', [])
+    except Exception as e:
+        logging.debug(f"Search API request failed: {str(e)}")
+        return None
+
+    scans = []
+    for result in results:
+        scan_data = process_search_result(result, base_url, seen_scan_urls, timestamp)
+        if scan_data:
+            scans.append(scan_data)
+    return scans
+
+
+def scrape_recent_scans(driver, base_url, seen_scan_urls, timestamp: str) -> List[Dict[str, Any]]:
+    """Render the landing page and collect new scans from its table"""
+    driver.get(base_url)
+    webdriver_utils.wait_for_selector(driver, "table", timeout=20)
+    html_content = driver.page_source
+
+    scans = []
+    for row in parse_scan_table(html_content):
+        scan_data = process_table_row(row, base_url, seen_scan_urls, timestamp)
+        if scan_data:
+            scans.append(scan_data)
+    return scans
+
+
+def url_producer(url_queue: Queue, backlog_count: Value, stop_flag: Value,
+                 seen_file: str):
     """Process that continuously fetches new URLs"""
     setup_logging()
     driver = None
-    seen_urls = set()
+    seen_scan_urls = SeenUrls(seen_file)
     base_url = "https://urlscan.io"
 
     try:
-        driver = webdriver_utils.create_chrome_driver()
-
         while not stop_flag.value:
             try:
-                # Get page content
-                driver.get(base_url)
-                wait = WebDriverWait(driver, 20)
-                wait.until(EC.presence_of_element_located((By.CSS_SELECTOR, "table")))
-                html_content = driver.page_source
-
-                # Parse content
-                soup = BeautifulSoup(html_content, 'html.parser')
-                table = soup.find('table')
-
-                if table:
-                    for row in table.find_all('tr')[1:]:
-                        scan_data = process_table_row(row, base_url, seen_urls)
-                        if scan_data:
-                            url_queue.put(scan_data)
-                            seen_urls.add(scan_data['url'])
-                            with backlog_lock:
-                                backlog_count.value += 1
+                # Every scan of one poll shares its timestamp
+                tick_timestamp = datetime.now().isoformat()
+                scans = fetch_recent_scans(base_url, seen_scan_urls, tick_timestamp)
+                if scans is None:
+                    # API unavailable; only now start a browser for the landing page
+                    if driver is None:
+                        driver = webdriver_utils.create_chrome_driver()
+                    scans = scrape_recent_scans(driver, base_url, seen_scan_urls, tick_timestamp)
+
+                new_scans = []
+                for scan_data in scans:
+                    if scan_data['scan_url'] not in seen_scan_urls:
+                        new_scans.append(scan_data)
+                        seen_scan_urls.add(scan_data['scan_url'])
+
+                if new_scans:
+                    put_many(url_queue, new_scans)
+                    with backlog_count.get_lock():
+                        backlog_count.value += len(new_scans)
+
+                seen_scan_urls.flush()
 
             except Exception as e:
                 logging.error(f"Error in URL producer: {str(e)}")
@@ -145,56 +241,150 @@ def url_producer(url_queue: Queue, backlog_count: Value, backlog_lock: Lock, sto
             driver.quit()
 
 
-def verdict_consumer(url_queue: Queue, backlog_count: Value, backlog_lock: Lock,
-                     stop_flag: Value, output_file: str, verdicts_file: str):
-    """Process that consumes URLs and gets their verdicts"""
-    setup_logging()
+def make_queue():
+    """Create a process-shared queue, backed by faster_fifo's shared-memory ring buffer if installed"""
+    if FastQueue is not None:
+        return FastQueue(max_size_bytes=QUEUE_SIZE_BYTES)
+    return Queue()
+
+
+def put_many(url_queue: Queue, items: List[Any]):
+    """Enqueue items, in a single write when the queue supports it"""
+    if hasattr(url_queue, 'put_many'):
+        url_queue.put_many(items)
+    else:
+        for item in items:
+            url_queue.put(item)
+
 
-    while not stop_flag.value or not url_queue.empty():
+def get_batch(url_queue: Queue, max_items: int, timeout: float = 5) -> List[Any]:
+    """Block for the first queued item, then take whatever else is ready up to max_items"""
+    if hasattr(url_queue, 'get_many'):
         try:
-            try:
-                scan_data = url_queue.get(timeout=5)
-            except Empty:
-                continue
+            return url_queue.get_many(timeout=timeout, max_messages_to_get=max_items)
+        except Empty:
+            return []
 
-            # Process the verdict
-            result = verdict_processor.process_verdict(scan_data)
+    try:
+        batch = [url_queue.get(timeout=timeout)]
+    except Empty:
+        return []
 
-            # Save results
-            if result:
-                # Save all results to the main results file
-                save_results([result], output_file, is_verdict=False)
+    while len(batch) < max_items:
+        try:
+            batch.append(url_queue.get_nowait())
+        except Empty:
+            break
+    return batch
 
-                # Only save malicious verdicts to the verdicts file
-                if result.get('verdict', '').lower() == 'malicious':
-                    verdict_data = {
-                        'url': result['url'],
-                        'scan_url': result['scan_url'],
-                        'verdict': result['verdict'],
-                        'metadata': result['verdict_metadata']
-                    }
-                    save_results([verdict_data], verdicts_file, is_verdict=True)
 
-            # Update backlog count
-            with backlog_lock:
-                backlog_count.value -= 1
+def verdict_consumer(url_queue: Queue, result_queue: Queue, backlog_count: Value,
+                     stop_flag: Value, num_workers: int = VERDICT_WORKERS,
+                     debugger_address: Optional[str] = None, proxies: Optional[List[Dict]] = None):
+    """Process that consumes URLs and gets their verdicts"""
+    setup_logging()
+    # Seeded with the proxies main() validated; failures evict proxies, and it refetches only once empty
+    proxy_handler = ProxyHandler(pool_ttl=None, proxies=proxies) if proxies else None
+    # An empty list means main() found no working proxies, so the drivers go out directly
+    use_proxy = proxies is None or bool(proxies)
+    driver_pool = webdriver_utils.ChromeDriverPool(size=num_workers, use_proxy=use_proxy,
+                                                   debugger_address=debugger_address,
+                                                   proxy_handler=proxy_handler)
+    process = partial(verdict_processor.process_verdict,
+                      driver_pool=driver_pool,
+                      rate_limiter=verdict_processor.RateLimiter(),
+                      proxy_handler=proxy_handler)
+    executor = ThreadPoolExecutor(max_workers=num_workers)
+
+    try:
+        while not stop_flag.value or not url_queue.empty():
+            try:
+                batch = get_batch(url_queue, num_workers)
+                if not batch:
+                    continue
+
+                # Process the verdicts concurrently, each worker leasing its own driver,
+                # and hand each one to the writer as soon as it finishes rather than after the slowest
+                futures = [executor.submit(process, scan_data) for scan_data in batch]
+
+                for future in as_completed(futures):
+                    result = future.result()
+
+                    if result:
+                        # Every result goes to the main results file
+                        result_queue.put(('result', result))
+
+                        # Only malicious verdicts go to the verdicts file
+                        if result.get('verdict', '').lower() == 'malicious':
+                            verdict_data = {
+                                'url': result['url'],
+                                'scan_url': result['scan_url'],
+                                'verdict': result['verdict'],
+                                'metadata': result['verdict_metadata']
+                            }
+                            result_queue.put(('verdict', verdict_data))
+
+                # Update backlog count
+                with backlog_count.get_lock():
+                    backlog_count.value -= len(batch)
 
-        except Exception as e:
-            logging.error(f"Error in verdict consumer: {str(e)}")
-            time.sleep(5)
+            except Exception as e:
+                logging.error(f"Error in verdict consumer: {str(e)}")
+                time.sleep(5)
+    finally:
+        executor.shutdown(wait=True)
+        driver_pool.close()
 
 
-def progress_monitor(backlog_count: Value, backlog_lock: Lock, stop_flag: Value):
+def result_writer(result_queue: Queue, output_file: str, verdicts_file: str, stats_file: str):
+    """Process that owns the output files, appending results in batches until it receives None"""
+    setup_logging()
+    stats = StatsAccumulator()
+    try:
+        stats.load(verdicts_file, output_file)
+    except Exception as e:
+        # Keep writing; the totals just restart from this run's results
+        logging.error(f"Error loading statistics from existing files: {str(e)}")
+        stats = StatsAccumulator()
+    stats_due = False
+    stats_updated_at = time.monotonic()
+    running = True
+
+    while running:
+        batch = get_batch(result_queue, WRITER_BATCH_SIZE, timeout=WRITER_FLUSH_TIMEOUT)
+        if None in batch:
+            running = False
+            batch = [item for item in batch if item is not None]
+
+        results = [record for kind, record in batch if kind == 'result']
+        verdicts = [record for kind, record in batch if kind == 'verdict']
+        for result in save_results(results, output_file, is_verdict=False):
+            stats.add_result(result)
+            stats_due = True
+        saved_verdicts = save_results(verdicts, verdicts_file, is_verdict=True)
+        if saved_verdicts:
+            stats.add_verdicts(saved_verdicts)
+            stats_due = True
+
+        # Counters are kept in memory; only rewriting the report is throttled
+        if stats_due and (not running or time.monotonic() - stats_updated_at >= STATS_INTERVAL):
+            save_statistics(stats.stats(), stats_file)
+            stats_due = False
+            stats_updated_at = time.monotonic()
+
+
+def progress_monitor(backlog_count: Value, stop_flag: Value):
     """Monitor and display progress"""
     with tqdm.tqdm(total=0, dynamic_ncols=True, desc="Backlog", unit="verdicts") as pbar:
         last_count = 0
         while not stop_flag.value:
-            with backlog_lock:
-                current_count = backlog_count.value
-                if current_count != last_count:
-                    pbar.total = max(pbar.total, current_count)
-                    pbar.n = pbar.total - current_count
-                    pbar.set_description(f"Backlog: {current_count}")
-                    pbar.refresh()
-                    last_count = current_count
+            # Read the raw c_int behind the synchronized wrapper, whose .value getter takes the lock;
+            # a half-second-stale count is fine for display
+            current_count = backlog_count.get_obj().value
+            if current_count != last_count:
+                pbar.total = max(pbar.total, current_count)
+                pbar.n = pbar.total - current_count
+                pbar.set_description(f"Backlog: {current_count}")
+                pbar.refresh()
+                last_count = current_count
             time.sleep(0.5)
\ No newline at end of file
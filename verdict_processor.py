@@ -1,61 +1,332 @@
+import os
 import re
 import logging
+import threading
 import time
 from datetime import datetime
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+import requests
+from requests.adapters import HTTPAdapter
 from bs4 import BeautifulSoup
+import soupsieve
+from selenium.common.exceptions import InvalidArgumentException, TimeoutException
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from webdriver_utils import create_chrome_driver
+from webdriver_utils import ChromeDriverPool, USER_AGENT, wait_for_selector
+from proxy_handler import ProxyHandler
+from html_utils import VerdictPage, make_soup, parse_verdict_page
+from storage_utils import loads
+
+# Token bucket for scan-page fetches shared by a consumer's worker threads
+PAGE_FETCH_RATE = 1.0
+PAGE_FETCH_BURST = 2
+
+# Explicit waits on a scan page; driver.get only waits for DOMContentLoaded (eager strategy)
+SUMMARY_WAIT_TIMEOUT = 10
+SECTION_WAIT_TIMEOUT = 5
+
+# Poll interval of the summary wait, in place of WebDriverWait's 500ms default
+WAIT_POLL_FREQUENCY = 0.1
+
+# Selenium attempts per scan, backing off exponentially from RETRY_BACKOFF seconds between them
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5
+
+# Keep-alive connections to urlscan.io per consumer; at least its worker thread count
+HTTP_POOL_SIZE = 4
+
+# Whole page titles urlscan.io serves for scans that don't exist (yet); matched exactly, since a
+# scanned site's own title can contain "404" or "Not Found"
+NOT_FOUND_TITLES = ('404 Not Found', 'Not Found', 'urlscan.io - 404 Not Found')
+
+# Banner shown in the summary of scans urlscan.io flags as malicious
+MALICIOUS_WARNING = 'Malicious Activity!'
+
+# Scan id in a result page URL, and the API endpoint serving the same scan as JSON
+RESULT_ID_RE = re.compile(r'/result/([0-9a-f-]{36})')
+RESULT_API_URL = "https://urlscan.io/api/v1/result/{}/"
+
+# The fields parse_verdict_page reads, computed in the browser so benign pages skip page_source;
+# returns [has_warning, panel_text, red_text], or null while there is no summary
+VERDICT_PAGE_JS = """
+const summary = document.getElementById('summary');
+if (!summary) {
+    return null;
+}
+const panel = document.querySelector('div.panel-body');
+const red = document.querySelector('span.red');
+return [summary.textContent.includes(arguments[0]),
+        panel ? panel.textContent : null,
+        red ? red.textContent : null];
+"""
+
+# Summary container attribute, looked for in the raw HTML before any parse
+SUMMARY_ID_RE = re.compile(r'id=["\']?summary["\'\s>]')
+
+# Verdict label selector, compiled once rather than parsed by each select_one call
+RED_SELECTOR = soupsieve.compile("span.red")
+
+# Label of the targeted-brands row; checked against the raw HTML before walking the tree
+BRANDS_LABEL = 'Targeting these brands:'
+
+# Expand every collapsed technology section, as clicking its toggle would, then return the
+# expanded sections with the <b> label preceding each as [label, outerHTML] pairs
+EXPANDED_SECTIONS_JS = """
+document.querySelectorAll("a[data-toggle='collapse']").forEach(button => {
+    const target = button.dataset.target && document.querySelector(button.dataset.target);
+    if (target && !target.classList.contains('in')) {
+        target.classList.add('in');
+        target.style.height = 'auto';
+    }
+});
+return Array.from(document.querySelectorAll('div.collapse.in')).map(section => {
+    const label = document.evaluate('preceding::b[1]', section, null,
+                                    XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    return [label ? label.textContent : '', section.outerHTML];
+});
+"""
+
+# "Brand (Category)" labels on the targeted-brand tags
+BRAND_RE = re.compile(r'([^(]*)\(([^()]*)')
+
+# ASN line of the summary panel, and the confidence strings of a technology section
+ASN_RE = re.compile(r'belongs to\s+([^\.]+)')
+CONFIDENCE_RE = re.compile(r'Overall confidence')
+PERCENT_RE = re.compile(r'\d+%')
+
+# Per-process HTTP session, created lazily so it is never shared across forks
+_http_session: Optional[requests.Session] = None
+
+
+class RateLimiter:
+    """Token bucket that spaces out page fetches across worker threads"""
+
+    def __init__(self, rate: float = PAGE_FETCH_RATE, capacity: float = PAGE_FETCH_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Block until a fetch token is available"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def get_http_session() -> requests.Session:
+    """Return this process's keep-alive HTTP session"""
+    global _http_session
+    if _http_session is None:
+        _http_session = requests.Session()
+        _http_session.headers['User-Agent'] = USER_AGENT
+        # Every fetch goes to one host, so one pool sized for all worker threads reuses every socket
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+        _http_session.mount('https://', adapter)
+        _http_session.mount('http://', adapter)
+    return _http_session
+
+
+def get_api_headers() -> Dict[str, str]:
+    """Headers for urlscan.io API requests, with the API key if URLSCAN_API_KEY is set"""
+    api_key = os.environ.get('URLSCAN_API_KEY')
+    return {'API-Key': api_key} if api_key else {}
+
+
+def not_found_verdict() -> Dict[str, Any]:
+    """Verdict data recorded for scans urlscan.io has no page for"""
+    return {
+        'verdict': "Error",
+        'verdict_metadata': {'error': "Scan page not found"}
+    }
+
+
+def proxied_get(url: str, proxy_handler: Optional[ProxyHandler] = None, **kwargs) -> requests.Response:
+    """GET through a proxy from the pool, if given, reporting whether the proxy got through"""
+    proxy = proxy_handler.get_working_proxy() if proxy_handler is not None else None
+    try:
+        response = get_http_session().get(url, proxies=proxy, timeout=15, **kwargs)
+    except (requests.exceptions.ProxyError, requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+        if proxy:
+            proxy_handler.report_failure(proxy)
+        raise
+    if proxy:
+        proxy_handler.report_success(proxy)
+    return response
+
+
+def fetch_static_verdict(scan_url: str, proxy_handler: Optional[ProxyHandler] = None) -> Optional[Dict[str, Any]]:
+    """Extract the verdict from the server-rendered scan page without a browser"""
+    try:
+        response = proxied_get(scan_url, proxy_handler)
+        if response.status_code == 404:
+            return not_found_verdict()
+        if response.status_code != 200:
+            return None
+
+        html_content = response.text
+        if not SUMMARY_ID_RE.search(html_content):
+            # Summary is rendered client-side for this page; leave it to Selenium without parsing
+            return None
+
+        verdict_data = quick_verdict_data(html_content, scan_url)
+        if verdict_data is not None:
+            return verdict_data
+
+        soup = make_soup(html_content)
+        if soup.find(id="summary") is None:
+            return None
+
+        return extract_verdict_data(soup, None, scan_url, html_content)
+    except Exception as e:
+        logging.debug(f"Static fetch failed for {scan_url}: {str(e)}")
+        return None
+
+
+def fetch_api_verdict(scan_url: str, proxy_handler: Optional[ProxyHandler] = None) -> Optional[Dict[str, Any]]:
+    """Build the verdict from the result API when the scan page doesn't carry it"""
+    scan_id = RESULT_ID_RE.search(scan_url)
+    if not scan_id:
+        return None
+
+    try:
+        response = proxied_get(RESULT_API_URL.format(scan_id.group(1)), proxy_handler,
+                               headers=get_api_headers())
+        if response.status_code != 200:
+            return None
+        return api_verdict_data(loads(response.content), scan_url)
+    except Exception as e:
+        logging.debug(f"Result API fetch failed for {scan_url}: {str(e)}")
+        return None
+
+
+def api_verdict_data(result: Dict[str, Any], scan_url: str) -> Dict[str, Any]:
+    """Map a result API document onto the metadata the page extractor produces"""
+    verdict_metadata = new_verdict_metadata(scan_url)
+    verdicts = result.get('verdicts', {})
+    is_malicious = bool(verdicts.get('overall', {}).get('malicious'))
+
+    # asnname reads like the page's ASN line, e.g. "CLOUDFLARENET, US"
+    asn_org = result.get('page', {}).get('asnname')
+    if asn_org:
+        set_asn_org(verdict_metadata, asn_org)
+
+    if is_malicious:
+        for brand in verdicts.get('urlscan', {}).get('brands', []):
+            if isinstance(brand, dict):
+                verdict_metadata['targeted_brands'].append({
+                    'name': brand.get('name', ''),
+                    'category': ', '.join(brand.get('vertical', [])) or "Unknown"
+                })
+            else:
+                verdict_metadata['targeted_brands'].append({'name': str(brand), 'category': "Unknown"})
+
+        wappa = result.get('meta', {}).get('processors', {}).get('wappa', {})
+        for technology in wappa.get('data', []):
+            confidence = technology.get('confidenceTotal')
+            verdict_metadata['detected_technologies'].append({
+                'technology': technology.get('app'),
+                'confidence': f"Overall confidence: {confidence}%" if confidence is not None else None,
+                'patterns': [c['pattern'] for c in technology.get('confidence', []) if c.get('pattern')]
+            })
+
+    return {
+        'verdict': "Malicious" if is_malicious else "No classification",
+        'verdict_metadata': verdict_metadata
+    }
+
+
+def process_verdict(scan_data: Dict[str, Any], driver_pool: ChromeDriverPool,
+                    max_retries: int = MAX_RETRIES,
+                    rate_limiter: Optional[RateLimiter] = None,
+                    proxy_handler: Optional[ProxyHandler] = None) -> Dict[str, Any]:
+    """Process a single verdict with retry logic
+
+    The plain HTTP fetches go out through proxy_handler's pool when given, as Chrome does.
+    """
+    scan_url = scan_data['scan_url']
+
+    # Most scan pages are server-rendered, so try a plain HTTP fetch before Chrome
+    if rate_limiter is not None:
+        rate_limiter.acquire()
+    verdict_data = fetch_static_verdict(scan_url, proxy_handler)
+    if verdict_data is None:
+        # No server-rendered summary; the result API has the same verdict as JSON
+        if rate_limiter is not None:
+            rate_limiter.acquire()
+        verdict_data = fetch_api_verdict(scan_url, proxy_handler)
+    if verdict_data is not None:
+        scan_data.update(verdict_data)
+        return scan_data
 
-def process_verdict(scan_data: Dict[str, Any], max_retries: int = 5) -> Dict[str, Any]:
-    """Process a single verdict with retry logic"""
     retry_count = 0
     while retry_count < max_retries:
-        driver = None
         try:
-            driver = create_chrome_driver(use_proxy=True)
-            scan_url = scan_data['scan_url']
-
-            driver.get(scan_url)
+            # A failing driver is discarded on the way out; the rest of the pool stays warm
+            with driver_pool.lease() as driver:
+                if rate_limiter is not None:
+                    rate_limiter.acquire()
+                driver.get(scan_url)
 
-            # Wait for summary section
-            wait = WebDriverWait(driver, 20)
-            summary = wait.until(EC.presence_of_element_located((By.ID, "summary")))
+                # Wait for summary section, or bail out early on a missing scan
+                wait = WebDriverWait(driver, SUMMARY_WAIT_TIMEOUT, poll_frequency=WAIT_POLL_FREQUENCY)
+                summary = wait.until(EC.any_of(
+                    EC.presence_of_element_located((By.ID, "summary")),
+                    page_not_found
+                ))
 
-            # Scroll to summary
-            driver.execute_script("arguments[0].scrollIntoView(true);", summary)
+                if summary is True:
+                    verdict_data = not_found_verdict()
+                else:
+                    # Scroll to summary
+                    driver.execute_script("arguments[0].scrollIntoView(true);", summary)
 
-            # Additional wait for dynamic content
-            time.sleep(5)
+                    # Wait for the panels we parse; the observer fires on the mutation that adds them
+                    # rather than on WebDriverWait's next 500ms poll
+                    try:
+                        wait_for_selector(driver, "div.panel-body, span.red", timeout=SECTION_WAIT_TIMEOUT)
+                    except TimeoutException:
+                        pass
 
-            html_content = driver.page_source
-            soup = BeautifulSoup(html_content, 'html.parser')
+                    page = driver.execute_script(VERDICT_PAGE_JS, MALICIOUS_WARNING)
+                    verdict_data = page_verdict_data(VerdictPage(*page) if page else None, scan_url)
+                    if verdict_data is None:
+                        # Only pages needing the full extraction pay for the page source transfer
+                        html_content = driver.page_source
+                        verdict_data = extract_verdict_data(make_soup(html_content), driver, scan_url,
+                                                            html_content)
 
-            verdict_data = extract_verdict_data(soup, driver, scan_url)
             scan_data.update(verdict_data)
             break
 
         except Exception as e:
             retry_count += 1
-            if retry_count == max_retries:
+            # A bad argument fails the same way every time; network errors are retried,
+            # on a relaunched driver with another proxy when the failing one was proxied
+            if retry_count == max_retries or isinstance(e, InvalidArgumentException):
                 scan_data['verdict'] = "Error"
                 scan_data['verdict_metadata'] = {'error': str(e)}
-
-        finally:
-            if driver:
-                try:
-                    driver.quit()
-                except Exception:
-                    pass
+                break
+            time.sleep(RETRY_BACKOFF * 2 ** (retry_count - 1))
 
     return scan_data
 
-def extract_verdict_data(soup: BeautifulSoup, driver, scan_url: str) -> Dict[str, Any]:
-    """Extract verdict information from the page"""
-    verdict = "No classification"
-    verdict_metadata = {
+def page_not_found(driver) -> bool:
+    """Expected condition that holds when urlscan.io served its not-found page"""
+    return driver.title.strip() in NOT_FOUND_TITLES
+
+def new_verdict_metadata(scan_url: str) -> Dict[str, Any]:
+    """Empty verdict metadata for a scan"""
+    return {
         'timestamp': datetime.now().isoformat(),
         'scan_url': scan_url,
         'targeted_brands': [],
@@ -64,50 +335,84 @@ def extract_verdict_data(soup: BeautifulSoup, driver, scan_url: str) -> Dict[str
         'detected_technologies': []
     }
 
+def extract_asn(verdict_metadata: Dict[str, Any], panel_text: Optional[str]):
+    """Fill in the ASN organization and location from the summary panel text"""
+    if not panel_text:
+        return
+
+    # Extract ASN organization
+    asn_match = ASN_RE.search(panel_text)
+    if asn_match:
+        set_asn_org(verdict_metadata, asn_match.group(1).strip())
+
+def set_asn_org(verdict_metadata: Dict[str, Any], asn_org: str):
+    """Record the ASN organization and the location suffix it ends with"""
+    verdict_metadata['asn_org'] = asn_org
+
+    # Extract location from ASN org (last two characters if they're present)
+    if ', ' in asn_org:
+        verdict_metadata['location'] = asn_org.split(', ')[-1]
+
+def is_malicious_page(has_warning: bool, red_text: Optional[str]) -> bool:
+    """Check for the malicious warning or a malicious (or potentially malicious) verdict label"""
+    return has_warning or (bool(red_text) and "Malicious" in red_text)
+
+def quick_verdict_data(html_content: str, scan_url: str) -> Optional[Dict[str, Any]]:
+    """Classify a benign scan page with Lexbor; None means the full parse is needed"""
+    return page_verdict_data(parse_verdict_page(html_content, MALICIOUS_WARNING), scan_url)
+
+def page_verdict_data(page: Optional[VerdictPage], scan_url: str) -> Optional[Dict[str, Any]]:
+    """Verdict data for a benign page from its summary fields; None means the full parse is needed"""
+    if page is None or is_malicious_page(page.has_warning, page.red_text):
+        return None
+
+    verdict_metadata = new_verdict_metadata(scan_url)
+    extract_asn(verdict_metadata, page.panel_text)
+    return {
+        'verdict': "No classification",
+        'verdict_metadata': verdict_metadata
+    }
+
+def extract_verdict_data(soup: BeautifulSoup, driver, scan_url: str,
+                         html_content: Optional[str] = None) -> Dict[str, Any]:
+    """Extract verdict information from the page, using the driver to expand sections if given
+
+    When the raw html_content is passed, substring checks on it skip tree walks for absent text.
+    """
+    verdict = "No classification"
+    verdict_metadata = new_verdict_metadata(scan_url)
+
     # Extract ASN information from summary panel
     summary_panel = soup.find('div', class_='panel-body')
-    if summary_panel:
-        # Find the text containing ASN info
-        location_text = summary_panel.get_text()
-
-        # Extract ASN organization
-        asn_match = re.search(r'belongs to\s+([^\.]+)', location_text)
-        if asn_match:
-            asn_org = asn_match.group(1).strip()
-            verdict_metadata['asn_org'] = asn_org
-
-            # Extract location from ASN org (last two characters if they're present)
-            if ', ' in asn_org:
-                verdict_metadata['location'] = asn_org.split(', ')[-1]
-
-    # Check for malicious warning
-    is_malicious = False
-    if soup.find(string=lambda text: text and 'Malicious Activity!' in str(text)):
-        verdict = "Malicious"
-        is_malicious = True
+    extract_asn(verdict_metadata, summary_panel.get_text() if summary_panel else None)
 
-    # Check verdict text for potentially malicious
-    verdict_element = soup.select_one("span.red")
-    if verdict_element and ("Malicious" in verdict_element.get_text() or
-                            "Potentially Malicious" in verdict_element.get_text()):
+    # Check for malicious warning, scoped to the summary container when present
+    has_warning = html_content is None or MALICIOUS_WARNING in html_content
+    if has_warning:
+        summary = soup.find(id="summary") or soup
+        has_warning = MALICIOUS_WARNING in summary.get_text()
+    red_element = RED_SELECTOR.select_one(soup)
+    is_malicious = is_malicious_page(has_warning, red_element.get_text() if red_element else None)
+    if is_malicious:
         verdict = "Malicious"
-        is_malicious = True
 
     # Only proceed with brand and technology checking if the verdict is malicious
     if is_malicious:
         # Extract targeted brands
         try:
-            targeting_section = soup.find(string=lambda text: text and 'Targeting these brands:' in str(text))
+            targeting_section = None
+            if html_content is None or BRANDS_LABEL in html_content:
+                targeting_section = soup.find(string=lambda text: text and BRANDS_LABEL in text)
             if targeting_section:
                 parent = targeting_section.parent
                 if parent:
                     brand_tags = parent.parent.find_all('span', class_='simpletag')
                     for brand_tag in brand_tags:
                         brand_text = brand_tag.get_text(strip=True)
-                        if '(' in brand_text:
-                            brand_parts = brand_text.split('(')
-                            brand_name = brand_parts[0].strip()
-                            brand_category = brand_parts[1].replace(')', '').strip()
+                        brand_match = BRAND_RE.match(brand_text)
+                        if brand_match:
+                            brand_name = brand_match.group(1).strip()
+                            brand_category = brand_match.group(2).strip()
                         else:
                             brand_name = brand_text
                             brand_category = "Unknown"
@@ -121,43 +426,40 @@ def extract_verdict_data(soup: BeautifulSoup, driver, scan_url: str) -> Dict[str
 
         # Extract detected technologies
         try:
-            expand_buttons = driver.find_elements(By.XPATH, "//a[@data-toggle='collapse']")
-            for button in expand_buttons:
-                target_id = button.get_attribute("data-target")  # e.g., #collapse-wappa-jQuery
-                associated_section = driver.find_element(By.CSS_SELECTOR, target_id)
+            if driver is not None:
+                # Expand and read back only the technology sections in a single round trip,
+                # instead of several commands per toggle plus the whole page source
+                expanded_sections = [
+                    (tech_name.strip(), make_soup(section_html).find('div'))
+                    for tech_name, section_html in driver.execute_script(EXPANDED_SECTIONS_JS)
+                ]
+            else:
+                # No browser to click with: mark every toggled section expanded, as clicking would
+                for button in soup.find_all('a', attrs={'data-toggle': 'collapse'}):
+                    target_id = (button.get('data-target') or '').lstrip('#')
+                    associated_section = soup.find(id=target_id) if target_id else None
+                    if associated_section and "in" not in associated_section.get("class", []):
+                        associated_section['class'] = associated_section.get("class", []) + ["in"]
 
-                # Skip if already expanded
-                if "in" in associated_section.get_attribute("class"):
-                    continue
-
-                # Click the button to expand the section
-                driver.execute_script("arguments[0].click();", button)
-
-                # Wait for the section to expand
-                WebDriverWait(driver, 5).until(
-                    lambda d: "in" in associated_section.get_attribute("class")
-                )
-
-            # Re-fetch the updated page source
-            updated_html = driver.page_source
-            updated_soup = BeautifulSoup(updated_html, 'html.parser')
+                expanded_sections = [
+                    (section.find_previous("b").get_text(strip=True), section)
+                    for section in soup.find_all("div", class_="collapse")
+                    if "in" in section.get("class", [])
+                ]
 
             # Process expanded sections
-            collapsed_sections = updated_soup.find_all("div", class_="collapse")
-            for section in collapsed_sections:
-                if "in" in section.get("class", []):
-                    tech_name = section.find_previous("b").get_text(strip=True)
-
+            for tech_name, section in expanded_sections:
+                if section is not None:
                     # Skip 'Resource Hash' and 'Security Headers'
                     if tech_name in ["Resource Hash", "Security Headers"]:
                         continue
 
                     # Extract full confidence information
-                    confidence_element = section.find(string=re.compile(r'Overall confidence'))
+                    confidence_element = section.find(string=CONFIDENCE_RE)
                     if confidence_element:
                         # Locate parent or sibling element for the full confidence text
                         confidence_parent = confidence_element.parent
-                        confidence_value = confidence_parent.find_next(string=re.compile(r'\d+%'))
+                        confidence_value = confidence_parent.find_next(string=PERCENT_RE)
                         if confidence_value:
                             confidence_text = f"{confidence_element.strip()} {confidence_value.strip()}"
                         else:
@@ -1,33 +1,361 @@
+import logging
+import os
+import queue
+import shutil
+import socket
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
 from selenium import webdriver
+from selenium.common.exceptions import TimeoutException, WebDriverException
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.chrome.options import Options
-from webdriver_manager.chrome import ChromeDriverManager
 from proxy_handler import ProxyHandler
 
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0.0.0 Safari/537.36'
 
-def create_chrome_driver(use_proxy: bool = False) -> webdriver.Chrome:
-    """Create and configure a Chrome WebDriver instance"""
+BROWSER_POOL_SIZE = 2
+BROWSER_POOL_RECYCLE_AFTER = 100
+
+# Headless flags tuned for many small-footprint instances; --no-zygote requires --no-sandbox
+CHROME_ARGUMENTS = [
+    '--headless=new',
+    '--no-sandbox',
+    '--no-zygote',
+    '--disable-dev-shm-usage',
+    '--disable-gpu',
+    '--window-size=1280,800',
+    '--disable-notifications',
+    '--disable-popup-blocking',
+    '--disable-extensions',
+    '--disable-background-networking',
+    '--disable-background-timer-throttling',
+    '--disable-renderer-backgrounding',
+    '--disable-sync',
+    # Site isolation (IsolateOrigins, site-per-process) stays on: these pages are often malicious,
+    # and a per-site renderer is worth its memory even when consumers share one browser
+    '--disable-features=Translate,MediaRouter,AudioServiceOutOfProcess',
+    '--disk-cache-size=1',
+    '--mute-audio',
+    '--blink-settings=imagesEnabled=false',
+    f'--user-agent={USER_AGENT}'
+]
+
+# One headless Chrome that consumers can attach to over CDP instead of each launching their own
+SHARED_BROWSER_ADDRESS = '127.0.0.1:9222'
+SHARED_BROWSER_PROFILE = '/tmp/urlscan-chrome'
+SHARED_BROWSER_STARTUP_TIMEOUT = 15
+CHROME_BINARIES = ('google-chrome', 'google-chrome-stable', 'chromium', 'chromium-browser')
+
+# Subresources the scrapers never read; blocking them cuts page-load time and memory
+BLOCKED_URL_PATTERNS = ['*.png', '*.jpg', '*.jpeg', '*.gif', '*.webp', '*.ico', '*.svg',
+                        '*.woff*', '*.ttf', '*.css', '*.mp4', '*.webm',
+                        '*googletagmanager*', '*google-analytics*', '*doubleclick*']
+
+# Chrome net errors from an unreachable network or proxy rather than a broken browser
+NETWORK_ERROR_MARKERS = ('ERR_NAME_NOT_RESOLVED', 'ERR_CONNECTION_REFUSED', 'ERR_ADDRESS_UNREACHABLE',
+                         'ERR_CONNECTION_RESET', 'ERR_CONNECTION_TIMED_OUT', 'ERR_TIMED_OUT',
+                         'ERR_PROXY_CONNECTION_FAILED', 'ERR_TUNNEL_CONNECTION_FAILED')
+
+# Resolves as soon as the selector matches, woken by DOM mutations instead of WebDriver polling
+WAIT_FOR_SELECTOR_JS = """
+const selector = arguments[0];
+const done = arguments[arguments.length - 1];
+const found = document.querySelector(selector);
+if (found) {
+    done(found);
+} else {
+    const observer = new MutationObserver(() => {
+        const element = document.querySelector(selector);
+        if (element) {
+            observer.disconnect();
+            done(element);
+        }
+    });
+    observer.observe(document.documentElement, {childList: true, subtree: true});
+}
+"""
+
+# ChromeDriver binary path, resolved once per process instead of on every launch;
+# setting CHROMEDRIVER_PATH to a pinned binary skips webdriver_manager altogether
+_driver_path: Optional[str] = None
+_driver_path_lock = threading.Lock()
+
+
+# Proxy pool for drivers launched without a proxy from the caller, validated once per process
+# and refetched only after its TTL rather than on every launch
+_proxy_handler: Optional[ProxyHandler] = None
+_proxy_handler_lock = threading.Lock()
+
+
+def get_proxy_handler() -> ProxyHandler:
+    """Return this process's shared, validated proxy pool"""
+    global _proxy_handler
+    with _proxy_handler_lock:
+        if _proxy_handler is None:
+            _proxy_handler = ProxyHandler()
+        return _proxy_handler
+
+
+def get_driver_path() -> str:
+    """Return the ChromeDriver path, installing or checking it on first use only"""
+    global _driver_path
+    with _driver_path_lock:
+        if _driver_path is None:
+            _driver_path = os.environ.get('CHROMEDRIVER_PATH')
+        if _driver_path is None:
+            # Silence webdriver_manager's startup logging (WDM_LOG_LEVEL on older releases)
+            os.environ.setdefault('WDM_LOG', '0')
+            os.environ.setdefault('WDM_LOG_LEVEL', '0')
+            from webdriver_manager.chrome import ChromeDriverManager
+            _driver_path = ChromeDriverManager().install()
+        return _driver_path
+
+
+def build_chrome_options(proxy_server: Optional[str] = None) -> Options:
+    """Options for a launched Chrome, the single place its flags and prefs are assembled"""
     chrome_options = Options()
-    chrome_options.add_argument('--headless=new')
-    chrome_options.add_argument('--no-sandbox')
-    chrome_options.add_argument('--disable-dev-shm-usage')
-    chrome_options.add_argument('--disable-gpu')
-    chrome_options.add_argument('--window-size=1920,1080')
-    chrome_options.add_argument('--disable-notifications')
-    chrome_options.add_argument('--disable-popup-blocking')
-
-    if use_proxy:
-        proxy_handler = ProxyHandler(max_proxies=1)
-        proxy = proxy_handler.get_working_proxy()
-        if proxy:
-            proxy_server = proxy['https']
-            chrome_options.add_argument(f'--proxy-server={proxy_server}')
+    # Return from get() at DOMContentLoaded; callers wait explicitly for the nodes they read
+    chrome_options.page_load_strategy = 'eager'
+    for argument in CHROME_ARGUMENTS:
+        chrome_options.add_argument(argument)
+    chrome_options.add_experimental_option('prefs', {
+        'profile.managed_default_content_settings.images': 2,
+        'profile.default_content_setting_values.notifications': 2
+    })
+
+    if proxy_server:
+        chrome_options.add_argument(f'--proxy-server={proxy_server}')
+
+    return chrome_options
+
 
-    user_agent = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) Chrome/120.0.0.0 Safari/537.36'
-    chrome_options.add_argument(f'user-agent={user_agent}')
+def create_chrome_driver(use_proxy: bool = False, proxy: Optional[Dict] = None) -> webdriver.Chrome:
+    """Create and configure a Chrome WebDriver instance, looking up a proxy only if none is given"""
+    if proxy is None and use_proxy:
+        proxy = get_proxy_handler().get_working_proxy()
+    chrome_options = build_chrome_options(proxy['https'] if proxy else None)
 
-    service = Service(ChromeDriverManager().install())
+    service = Service(get_driver_path())
     driver = webdriver.Chrome(service=service, options=chrome_options)
+    configure_driver(driver)
+
+    return driver
+
+
+def configure_driver(driver: webdriver.Chrome):
+    """Apply the page-load timeout and subresource blocking to the driver's current tab"""
     driver.set_page_load_timeout(30)
+    driver.execute_cdp_cmd('Network.enable', {})
+    driver.execute_cdp_cmd('Network.setBlockedURLs', {'urls': BLOCKED_URL_PATTERNS})
+
+
+def launch_shared_browser(use_proxy: bool = False, proxy: Optional[Dict] = None) -> subprocess.Popen:
+    """Start the headless Chrome that consumers attach to, waiting for its debugging port"""
+    binary = os.environ.get('CHROME_BINARY')
+    if not binary:
+        binary = next((path for path in map(shutil.which, CHROME_BINARIES) if path), None)
+    if not binary:
+        raise RuntimeError("No Chrome binary found; set CHROME_BINARY")
+
+    host, port = SHARED_BROWSER_ADDRESS.split(':')
+    arguments = [binary] + CHROME_ARGUMENTS + [
+        f'--remote-debugging-port={port}',
+        f'--user-data-dir={SHARED_BROWSER_PROFILE}'
+    ]
+
+    if proxy is None and use_proxy:
+        proxy = get_proxy_handler().get_working_proxy()
+    if proxy:
+        arguments.append(f"--proxy-server={proxy['https']}")
+
+    browser = subprocess.Popen(arguments, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + SHARED_BROWSER_STARTUP_TIMEOUT
+    while True:
+        try:
+            socket.create_connection((host, int(port)), timeout=1).close()
+            return browser
+        except OSError:
+            if browser.poll() is not None or time.monotonic() > deadline:
+                browser.kill()
+                raise RuntimeError("Shared Chrome did not open its debugging port")
+            time.sleep(0.2)
+
+
+def attach_chrome_driver(debugger_address: str = SHARED_BROWSER_ADDRESS) -> webdriver.Chrome:
+    """Attach a WebDriver session to the shared browser, working in a tab of its own"""
+    chrome_options = Options()
+    chrome_options.page_load_strategy = 'eager'
+    chrome_options.add_experimental_option('debuggerAddress', debugger_address)
+
+    service = Service(get_driver_path())
+    driver = webdriver.Chrome(service=service, options=chrome_options)
+    driver.switch_to.new_window('tab')
+    configure_driver(driver)
+
+    return driver
+
+
+def wait_for_selector(driver: webdriver.Chrome, selector: str, timeout: float = 20):
+    """Wait for an element in one round-trip; raises TimeoutException on timeout"""
+    driver.set_script_timeout(timeout)
+    return driver.execute_async_script(WAIT_FOR_SELECTOR_JS, selector)
+
+
+def is_network_error(error: Exception) -> bool:
+    """Check whether a WebDriver error is Chrome failing to reach the host"""
+    message = str(error)
+    return any(marker in message for marker in NETWORK_ERROR_MARKERS)
+
+
+def quit_driver(driver: webdriver.Chrome):
+    """Quit a driver, ignoring errors from an already dead session"""
+    try:
+        driver.quit()
+    except Exception:
+        pass
+
+
+class ChromeDriverPool:
+    """Pool of long-lived Chrome drivers leased out one request at a time"""
+
+    def __init__(self, size: int = BROWSER_POOL_SIZE, use_proxy: bool = False,
+                 recycle_after: int = BROWSER_POOL_RECYCLE_AFTER,
+                 debugger_address: Optional[str] = None, proxy_handler: Optional[ProxyHandler] = None):
+        self.use_proxy = use_proxy
+        # Pool launches pick from, and report failing proxies to; defaults to the process-wide one
+        self.proxy_handler = proxy_handler
+        self.debugger_address = debugger_address
+        self.recycle_after = recycle_after
+        self.idle_drivers: queue.Queue = queue.Queue()
+        self.use_counts: Dict[int, int] = {}
+        # Proxy each launched driver was started with, keyed by id(driver)
+        self.driver_proxies: Dict[int, Dict] = {}
+        self.closed = False
+
+        # Pre-launch the pool in the background so the first lease doesn't pay every cold start
+        for _ in range(size):
+            self._launch_replacement()
+
+    def acquire(self) -> webdriver.Chrome:
+        """Lease a driver, launching one if its slot has no live driver"""
+        driver = self.idle_drivers.get()
+        if driver is not None and driver.session_id is None:
+            # Quit elsewhere while idle; treat the slot as empty
+            self.use_counts.pop(id(driver), None)
+            driver = None
+        if driver is None:
+            try:
+                driver = self._new_driver()
+            except Exception:
+                self.idle_drivers.put(None)
+                raise
+        return driver
+
+    def release(self, driver: webdriver.Chrome):
+        """Return a healthy driver, recycling it once it has served enough requests"""
+        self.use_counts[id(driver)] = self.use_counts.get(id(driver), 0) + 1
+        if self.use_counts[id(driver)] >= self.recycle_after:
+            self.discard(driver)
+            return
+
+        # Don't let one scan's session state leak into the next lease, and unload the page
+        # so its scripts and memory don't linger while the driver sits idle
+        try:
+            driver.delete_all_cookies()
+            driver.get('about:blank')
+        except Exception:
+            self.discard(driver)
+            return
+        self.idle_drivers.put(driver)
+
+    @contextmanager
+    def lease(self):
+        """Lease a driver for a block, discarding it afterwards only if its session was lost"""
+        driver = self.acquire()
+        try:
+            yield driver
+        except TimeoutException:
+            # A slow page doesn't mean a broken browser; release() resets the tab or discards it
+            self.release(driver)
+            raise
+        except WebDriverException as e:
+            proxy = self.driver_proxies.get(id(driver))
+            if is_network_error(e) and proxy is None:
+                # The browser is fine and has no proxy to rotate away from; keep it
+                self.release(driver)
+            else:
+                # Lost session, or a proxy that can't reach the host: relaunch on a fresh proxy
+                if proxy is not None and is_network_error(e):
+                    self._proxy_handler().report_failure(proxy)
+                self.discard(driver)
+            raise
+        except Exception:
+            # Parsing errors leave the session intact
+            self.release(driver)
+            raise
+        if id(driver) in self.driver_proxies:
+            self._proxy_handler().report_success(self.driver_proxies[id(driver)])
+        self.release(driver)
+
+    def discard(self, driver: webdriver.Chrome):
+        """Quit a bad or worn-out driver and launch its replacement asynchronously"""
+        self.use_counts.pop(id(driver), None)
+        self.driver_proxies.pop(id(driver), None)
+        self._quit(driver)
+        self._launch_replacement()
+
+    def close(self):
+        """Quit every idle driver in the pool"""
+        self.closed = True
+        while True:
+            try:
+                driver = self.idle_drivers.get_nowait()
+            except queue.Empty:
+                break
+            if driver:
+                self._quit(driver)
+
+    def _new_driver(self) -> webdriver.Chrome:
+        if self.debugger_address:
+            driver = attach_chrome_driver(self.debugger_address)
+            proxy = None
+        else:
+            proxy = self._proxy_handler().get_working_proxy() if self.use_proxy else None
+            driver = create_chrome_driver(proxy=proxy)
+        self.use_counts[id(driver)] = 0
+        if proxy:
+            self.driver_proxies[id(driver)] = proxy
+        return driver
+
+    def _proxy_handler(self) -> ProxyHandler:
+        return self.proxy_handler or get_proxy_handler()
+
+    def _quit(self, driver: webdriver.Chrome):
+        # An attached session only owns its tab; close it so the shared browser doesn't fill up
+        if self.debugger_address:
+            try:
+                driver.close()
+            except Exception:
+                pass
+        quit_driver(driver)
+
+    def _launch_replacement(self):
+        thread = threading.Thread(target=self._fill_slot)
+        thread.daemon = True
+        thread.start()
+
+    def _fill_slot(self):
+        try:
+            driver = self._new_driver()
+        except Exception as e:
+            logging.error(f"Error launching pooled driver: {str(e)}")
+            driver = None
 
-    return driver
\ No newline at end of file
+        if self.closed and driver:
+            self._quit(driver)
+            return
+        self.idle_drivers.put(driver)